@@ -1,6 +1,16 @@
+import datetime
+import hashlib
+import hmac
+import io
 import json
+import struct
+import types
+import urllib.request
+from unittest import mock
 
 import pytest
+from botocore.exceptions import ConnectionClosedError
+from botocore.response import StreamingBody
 
 from uploader_lambda import app
 
@@ -21,3 +31,431 @@ def test_lambda_handler(s3_event):
     assert ret["statusCode"] == 200
     assert "message" in ret["body"]
     assert data["message"] == "hello world"
+
+
+class FakeS3:
+    """ Minimal S3 client serving ranged GetObject requests from memory"""
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range):
+        start = int(Range[len("bytes="):].split("-")[0])
+        self.ranges.append(start)
+        body = self.data[start:]
+        return {"Body": StreamingBody(io.BytesIO(body), len(body))}
+
+
+def test_s3_object_reader_streams_sequentially():
+    data = bytes(range(256)) * 100
+    s3 = FakeS3(data)
+    reader = app.S3ObjectReader(s3, "bucket", "key", len(data), chunk_size=4096)
+
+    assert reader.seek(0, io.SEEK_END) == len(data)
+    reader.seek(0)
+    chunks = list(iter(lambda: reader.read(1000), b""))
+
+    assert b"".join(chunks) == data
+    assert s3.ranges == [0]
+
+
+def test_s3_object_reader_reopens_after_seek():
+    data = bytes(range(256)) * 100
+    s3 = FakeS3(data)
+    reader = app.S3ObjectReader(s3, "bucket", "key", len(data), chunk_size=4096)
+    stream = io.BufferedReader(reader, buffer_size=4096)
+
+    assert stream.read(5000) == data[:5000]
+    stream.seek(1234)
+    assert stream.read(10) == data[1234:1244]
+    assert s3.ranges[0] == 0
+    assert s3.ranges[-1] == 1234
+
+
+def test_s3_object_reader_raises_producer_errors():
+    s3 = FakeS3(b"")
+    s3.get_object = lambda **kwargs: (_ for _ in ()).throw(IOError("boom"))
+    reader = app.S3ObjectReader(s3, "bucket", "key", 10)
+
+    with pytest.raises(IOError, match="boom"):
+        reader.read(10)
+
+
+def test_get_upload_chunk_size():
+    assert app.get_upload_chunk_size(100 * 1024 * 1024) == app.UPLOAD_CHUNK_SIZE
+    assert app.get_upload_chunk_size(3 * 1024 * 1024 * 1024) == app.LARGE_FILE_UPLOAD_CHUNK_SIZE
+
+
+def test_sign_webhook_payload(monkeypatch):
+    monkeypatch.setattr(app, "get_webhook_secret", lambda: b"secret")
+    payload = b'{"youtube_video_id": "abc"}'
+
+    expected = hmac.new(b"secret", payload, hashlib.sha256).hexdigest()
+    assert app.sign_webhook_payload(payload) == expected
+    assert app.sign_webhook_payload(payload) == expected
+
+
+def test_sign_webhook_payload_without_secret(monkeypatch):
+    monkeypatch.setattr(app, "get_webhook_secret", lambda: None)
+
+    assert app.sign_webhook_payload(b"{}") is None
+
+
+def test_s3_object_reader_uses_initial_body():
+    data = bytes(range(256)) * 100
+    s3 = FakeS3(data)
+    body = StreamingBody(io.BytesIO(data), len(data))
+    reader = app.S3ObjectReader(s3, "bucket", "key", len(data), chunk_size=4096, body=body)
+
+    assert b"".join(iter(lambda: reader.read(1000), b"")) == data
+    assert s3.ranges == []
+
+
+def test_s3_object_reader_retries_stale_initial_body():
+    data = bytes(range(256)) * 100
+
+    class StaleBody:
+        def iter_chunks(self, chunk_size):
+            yield data[:4096]
+            raise IOError("connection reset")
+
+        def close(self):
+            pass
+
+    s3 = FakeS3(data)
+    reader = app.S3ObjectReader(s3, "bucket", "key", len(data), chunk_size=4096, body=StaleBody())
+
+    assert b"".join(iter(lambda: reader.read(1000), b"")) == data
+    assert s3.ranges == [4096]
+
+
+def test_lambda_handler_requires_s3_key():
+    ret = app.lambda_handler({}, "")
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"])["error"] == "Missing required parameter: s3_key"
+
+
+def test_get_cached_secret_expires(monkeypatch):
+    secrets = mock.Mock()
+    secrets.batch_get_secret_value.return_value = {
+        "SecretValues": [{"Name": "id", "ARN": "arn:id", "SecretString": '{"TOKEN": "t"}'}],
+        "Errors": [],
+    }
+    now = [1000.0]
+    monkeypatch.setattr(app, "_SECRETS", secrets)
+    monkeypatch.setattr(app, "_SECRETS_CACHE", {})
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+
+    assert app._get_cached_secret("id", json.loads) == {"TOKEN": "t"}
+    now[0] += app.SECRET_CACHE_TTL_SECONDS - 1
+    app._get_cached_secret("id", json.loads)
+    assert secrets.batch_get_secret_value.call_count == 1
+
+    now[0] += 2
+    app._get_cached_secret("id", json.loads)
+    assert secrets.batch_get_secret_value.call_count == 2
+
+
+def test_get_cached_secret_batches_configured_secrets(monkeypatch):
+    secrets = mock.Mock()
+    secrets.batch_get_secret_value.return_value = {
+        "SecretValues": [
+            {"Name": "youtube", "ARN": "arn:youtube", "SecretString": '{"TOKEN": "t"}'},
+            {"Name": "webhook", "ARN": "arn:webhook", "SecretString": "secret"},
+        ],
+        "Errors": [],
+    }
+    monkeypatch.setattr(app, "_SECRETS", secrets)
+    monkeypatch.setattr(app, "_SECRETS_CACHE", {})
+    monkeypatch.setenv("YOUTUBE_API_SECRET_ID", "youtube")
+    monkeypatch.setenv("WEBHOOK_SECRET_ID", "webhook")
+
+    assert app._get_cached_secret("youtube", json.loads) == {"TOKEN": "t"}
+    assert app.get_webhook_secret() == b"secret"
+    secrets.batch_get_secret_value.assert_called_once()
+    assert sorted(secrets.batch_get_secret_value.call_args.kwargs["SecretIdList"]) == ["webhook", "youtube"]
+
+
+def test_get_video_duration_returns_probe_for_reuse(monkeypatch):
+    probe = {"streams": [{"codec_type": "video", "duration": "12.5"}], "format": {}}
+    probe_calls = []
+    monkeypatch.setattr(app, "probe_video", lambda path: probe_calls.append(path) or probe)
+
+    assert app.get_video_duration("video.mp4") == (12500, probe)
+
+    # A thumbnail generated with the shared probe doesn't probe the video again
+    monkeypatch.setattr(app.subprocess, "run", mock.Mock(side_effect=app.subprocess.CalledProcessError(1, "ffmpeg", b"", b"")))
+    app.generate_thumbnail("video.mp4", 12500, probe=probe)
+    assert probe_calls == ["video.mp4"]
+
+
+def test_create_thumbnail_skips_upload_without_thumbnail(monkeypatch):
+    monkeypatch.setattr(app, "get_video_duration", lambda path, read=None, size=None: (12500, {}))
+    monkeypatch.setattr(app, "generate_thumbnail", lambda path, duration_ms, probe=None: None)
+    upload_to_s3 = mock.Mock()
+    monkeypatch.setattr(app, "upload_to_s3", upload_to_s3)
+
+    assert app.create_thumbnail("video.mp4", "bucket", "key") == (12500, None)
+    upload_to_s3.assert_not_called()
+
+
+def test_upload_to_s3_missing_file(monkeypatch):
+    s3 = mock.Mock()
+    s3.upload_file.side_effect = FileNotFoundError("missing.jpg")
+    monkeypatch.setattr(app, "_S3", s3)
+
+    assert app.upload_to_s3("missing.jpg", "bucket", "key") is None
+
+
+def mp4_box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def test_read_mp4_duration():
+    mvhd_v0 = mp4_box(b"mvhd", bytes(4) + struct.pack(">IIII", 0, 0, 1000, 12500) + bytes(80))
+    mvhd_v1 = mp4_box(b"mvhd", b"\x01" + bytes(3) + struct.pack(">QQIQ", 0, 0, 90000, 90000 * 42) + bytes(80))
+    ftyp = mp4_box(b"ftyp", b"isom" + bytes(4))
+    mdat = mp4_box(b"mdat", bytes(1000))
+
+    for mvhd, expected in ((mvhd_v0, 12500), (mvhd_v1, 42000)):
+        # moov after mdat, as most cameras write it
+        data = ftyp + mdat + mp4_box(b"moov", mp4_box(b"free", bytes(8)) + mvhd)
+        reads = []
+
+        def read(offset, length):
+            reads.append(offset)
+            return data[offset:offset + length]
+
+        assert app.read_mp4_duration(read, len(data)) == expected
+        assert len(reads) < 10
+
+    assert app.read_mp4_duration(lambda offset, length: b"\xff" * length, 4096) is None
+
+
+def test_get_video_duration_prefers_mp4_header(monkeypatch):
+    monkeypatch.setattr(app, "read_mp4_duration", lambda read, size: 12500)
+    monkeypatch.setattr(app, "probe_video", mock.Mock())
+
+    assert app.get_video_duration("video.mp4", read=mock.Mock(), size=100) == (12500, None)
+    app.probe_video.assert_not_called()
+
+
+def test_upload_to_s3_sets_content_type(monkeypatch):
+    s3 = mock.Mock()
+    monkeypatch.setattr(app, "_S3", s3)
+
+    assert app.upload_to_s3("thumb.jpg", "bucket", "key.jpg", content_type="image/jpeg").endswith("/key.jpg")
+    assert s3.upload_file.call_args.kwargs["ExtraArgs"] == {"ContentType": "image/jpeg"}
+
+
+def test_create_thumbnail_removes_uploaded_file(monkeypatch, tmp_path):
+    thumbnail = tmp_path / "thumb.jpg"
+    thumbnail.write_bytes(b"jpeg")
+    monkeypatch.setattr(app, "get_video_duration", lambda path, read=None, size=None: (12500, None))
+    monkeypatch.setattr(app, "generate_thumbnail", lambda path, duration_ms, probe=None: str(thumbnail))
+    monkeypatch.setattr(app, "upload_to_s3", lambda *args, **kwargs: "https://bucket/key")
+
+    assert app.create_thumbnail("video.mp4", "bucket", "key") == (12500, "https://bucket/key")
+    assert not thumbnail.exists()
+
+
+def test_s3_proxy_passes_ranges_through(monkeypatch):
+    data = bytes(range(256)) * 100
+
+    class RangedS3:
+        def get_object(self, Bucket, Key, Range=None):
+            assert (Bucket, Key, Range) == ("bucket", "videos/my video.mp4", "bytes=100-199")
+            body = data[100:200]
+            return {
+                "Body": StreamingBody(io.BytesIO(body), len(body)),
+                "ContentLength": len(body),
+                "ContentRange": f"bytes 100-199/{len(data)}",
+            }
+
+    monkeypatch.setattr(app, "_S3", RangedS3())
+    url = app.get_s3_proxy_url("bucket", "videos/my video.mp4")
+    assert url.startswith("http://127.0.0.1:")
+
+    request = urllib.request.Request(url, headers={"Range": "bytes=100-199"})
+    with urllib.request.urlopen(request) as response:
+        assert response.status == 206
+        assert response.headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+        assert response.read() == data[100:200]
+
+
+def test_s3_object_reader_wraps_botocore_errors():
+    s3 = FakeS3(b"")
+    s3.get_object = lambda **kwargs: (_ for _ in ()).throw(ConnectionClosedError(endpoint_url="https://s3"))
+    reader = app.S3ObjectReader(s3, "bucket", "key", 10)
+
+    with pytest.raises(IOError) as excinfo:
+        reader.read(10)
+    assert isinstance(excinfo.value.__cause__, ConnectionClosedError)
+
+
+def fake_youtube(*results):
+    request = mock.Mock()
+    request.next_chunk.side_effect = results
+    youtube = mock.Mock()
+    youtube.videos.return_value.insert.return_value = request
+    return youtube, request
+
+
+def http_error(status):
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    return HttpError(httplib2.Response({"status": status}), b"error")
+
+
+def test_upload_to_youtube_retries_retriable_errors(monkeypatch):
+    sleep = mock.Mock()
+    monkeypatch.setattr(app.time, "sleep", sleep)
+    youtube, request = fake_youtube(IOError("connection reset"), http_error(503), (None, {"id": "abc"}))
+
+    assert app.upload_to_youtube(youtube, io.BytesIO(b"video"), "video/mp4", "title") == "abc"
+    assert request.next_chunk.call_count == 3
+    assert [c.args[0] for c in sleep.call_args_list] == [2, 4]
+
+
+def test_upload_to_youtube_gives_up_on_non_retriable_errors(monkeypatch):
+    sleep = mock.Mock()
+    monkeypatch.setattr(app.time, "sleep", sleep)
+    youtube, request = fake_youtube(http_error(403), (None, {"id": "abc"}))
+
+    assert app.upload_to_youtube(youtube, io.BytesIO(b"video"), "video/mp4", "title") is None
+    assert request.next_chunk.call_count == 1
+    sleep.assert_not_called()
+
+
+@pytest.fixture()
+def youtube_auth(monkeypatch):
+    """ Stubs Secrets Manager and the Google client so get_authenticated_service runs offline"""
+    import google.auth.exceptions
+    import google.auth.transport.requests
+    import google.oauth2.credentials
+    import googleapiclient.discovery
+
+    now = datetime.datetime.utcnow()
+    state = types.SimpleNamespace(
+        secret={
+            "TOKEN": "token-0",
+            "REFRESH_TOKEN": "refresh-0",
+            "TOKEN_URI": "https://oauth2.googleapis.com/token",
+            "CLIENT_ID": "client",
+            "CLIENT_SECRET": "client-secret",
+            "EXPIRY": (now - datetime.timedelta(minutes=1)).isoformat(),
+        },
+        secrets=mock.Mock(),
+        build=mock.Mock(side_effect=lambda *args, **kwargs: object()),
+        refreshes=[],
+        rotate_refresh_token=False,
+        reject_refresh_token=None,
+    )
+    state.secrets.batch_get_secret_value.side_effect = lambda SecretIdList: {
+        "SecretValues": [{"Name": "youtube", "ARN": "arn:youtube", "SecretString": json.dumps(state.secret)}],
+        "Errors": [],
+    }
+
+    class FakeCredentials:
+        def __init__(self, token, refresh_token, expiry, **kwargs):
+            self.token = token
+            self.refresh_token = refresh_token
+            self.expiry = expiry
+
+        @property
+        def valid(self):
+            return self.expiry > datetime.datetime.utcnow()
+
+        def refresh(self, request):
+            state.refreshes.append(self.refresh_token)
+            if self.refresh_token == state.reject_refresh_token:
+                raise google.auth.exceptions.RefreshError("invalid_grant")
+            self.token = f"token-{len(state.refreshes)}"
+            self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+            if state.rotate_refresh_token:
+                self.refresh_token = f"refresh-{len(state.refreshes)}"
+
+    monkeypatch.setattr(google.oauth2.credentials, "Credentials", FakeCredentials)
+    monkeypatch.setattr(google.auth.transport.requests, "Request", mock.Mock)
+    monkeypatch.setattr(googleapiclient.discovery, "build", state.build)
+    monkeypatch.setattr(app, "_SECRETS", state.secrets)
+    monkeypatch.setattr(app, "_SECRETS_CACHE", {})
+    monkeypatch.setattr(app, "_CREDS", None)
+    monkeypatch.setattr(app, "_YOUTUBE", None)
+    monkeypatch.setenv("YOUTUBE_API_SECRET_ID", "youtube")
+    monkeypatch.delenv("WEBHOOK_SECRET_ID", raising=False)
+    return state
+
+
+def test_get_authenticated_service_reloads_secret_after_refresh_error(youtube_auth):
+    first = app.get_authenticated_service()
+
+    # Someone re-authorised and stored a new refresh token while the sandbox was warm
+    app._CREDS.expiry = datetime.datetime.utcnow()
+    youtube_auth.reject_refresh_token = "refresh-0"
+    youtube_auth.secret["REFRESH_TOKEN"] = "refresh-new"
+
+    second = app.get_authenticated_service()
+
+    assert second is not first
+    assert app._CREDS.refresh_token == "refresh-new"
+    assert youtube_auth.refreshes == ["refresh-0", "refresh-0", "refresh-new"]
+    assert youtube_auth.secrets.batch_get_secret_value.call_count == 2
+
+
+def test_get_authenticated_service_reuses_fresh_credentials(youtube_auth):
+    service = app.get_authenticated_service()
+
+    # A fresh token takes the early return: no secret fetch, refresh or rebuild
+    assert app.get_authenticated_service() is service
+    assert youtube_auth.refreshes == ["refresh-0"]
+    youtube_auth.build.assert_called_once()
+    youtube_auth.secrets.batch_get_secret_value.assert_called_once()
+
+
+def test_get_authenticated_service_skips_refresh_for_fresh_secret_token(youtube_auth):
+    youtube_auth.secret["EXPIRY"] = (datetime.datetime.utcnow() + datetime.timedelta(hours=1)).isoformat()
+
+    app.get_authenticated_service()
+
+    assert youtube_auth.refreshes == []
+
+
+def test_get_authenticated_service_refreshes_expiring_token_in_place(youtube_auth):
+    service = app.get_authenticated_service()
+    creds = app._CREDS
+
+    # Within the refresh margin the same credentials are refreshed and the service kept
+    creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=app.TOKEN_REFRESH_MARGIN_SECONDS - 10)
+    assert app.get_authenticated_service() is service
+    assert app._CREDS is creds
+    assert youtube_auth.refreshes == ["refresh-0", "refresh-0"]
+    youtube_auth.build.assert_called_once()
+
+
+def test_get_authenticated_service_persists_only_rotated_refresh_tokens(youtube_auth):
+    app.get_authenticated_service()
+    youtube_auth.secrets.put_secret_value.assert_not_called()
+
+    youtube_auth.rotate_refresh_token = True
+    app._CREDS.expiry = datetime.datetime.utcnow()
+    app.get_authenticated_service()
+
+    youtube_auth.secrets.put_secret_value.assert_called_once()
+    persisted = json.loads(youtube_auth.secrets.put_secret_value.call_args.kwargs["SecretString"])
+    assert persisted["REFRESH_TOKEN"] == "refresh-2"
+    assert persisted["TOKEN"] == "token-2"
+    assert persisted["CLIENT_SECRET"] == "client-secret"
+
+
+def test_get_authenticated_service_retries_failed_build(youtube_auth):
+    youtube_auth.build.side_effect = [Exception("discovery failed"), "service"]
+
+    with pytest.raises(Exception, match="discovery failed"):
+        app.get_authenticated_service()
+    assert app._CREDS is None
+
+    assert app.get_authenticated_service() == "service"
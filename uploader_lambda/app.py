@@ -1,114 +1,726 @@
+import concurrent.futures
+import datetime
+import functools
+import hmac
+import http.server
+import io
 import json
+import logging
 import boto3
 import os
-import mimetypes
-import requests
-import ffmpeg
+import queue
+import struct
+import subprocess
+import threading
+import time
+import urllib.parse
 import uuid
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 # YouTube API constants
 YOUTUBE_UPLOAD_SCOPE = "https://www.googleapis.com/auth/youtube.upload"
 YOUTUBE_API_SERVICE_NAME = "youtube"
 YOUTUBE_API_VERSION = "v3"
 RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+MAX_UPLOAD_RETRIES = 10
+MAX_RETRY_SLEEP_SECONDS = 32
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files larger than this are uploaded in bigger chunks to cut down on round trips
+LARGE_FILE_THRESHOLD = 2 * 1024 * 1024 * 1024
+LARGE_FILE_UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Log upload progress each time it crosses another multiple of this percentage
+PROGRESS_LOG_STEP = 10
+
+# Number of chunks read ahead from S3 while the upload is in flight
+PREFETCH_CHUNKS = 4
+
+# Size of the reads the loopback proxy streams S3 responses to ffmpeg in
+PROXY_CHUNK_SIZE = 256 * 1024
+
+# Fail an ffmpeg/ffprobe read that makes no progress for this long
+FFMPEG_RW_TIMEOUT_SECONDS = 30
+
+# Kill an ffmpeg/ffprobe run that takes longer than this altogether
+FFMPEG_TIMEOUT_SECONDS = 120
+
+# How long to wait for the thumbnail once the YouTube upload is done
+THUMBNAIL_WAIT_SECONDS = 60
+
+# Give up looking for the MP4 duration after walking this many boxes at one level
+MP4_MAX_BOXES = 32
+
+# JPEG quality of generated thumbnails, from 2 (best) to 31 (worst)
+THUMBNAIL_JPEG_QUALITY = 3
+
+# Give up on the webhook if it doesn't respond within this long
+WEBHOOK_TIMEOUT_SECONDS = 5
+
+# Re-fetch cached secrets after this long so rotations are picked up
+SECRET_CACHE_TTL_SECONDS = 300
+
+# Refresh the YouTube access token when it has less than this long left
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# Keep connections alive between invocations and back off adaptively when throttled.
+# The pool is sized for the S3 read-ahead plus the ranged reads ffmpeg makes through the proxy.
+_BOTO_CONFIG = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 3},
+    tcp_keepalive=True,
+    max_pool_connections=20
+)
+
+# AWS clients are created once per sandbox during init and reused by warm invocations
+_S3 = boto3.client('s3', config=_BOTO_CONFIG)
+_SECRETS = boto3.client(
+    'secretsmanager',
+    region_name=os.environ.get('AWS_SECRETS_MANAGER_REGION', 'us-west-1'),
+    config=_BOTO_CONFIG
+)
+
+# Cached across warm invocations
+_CREDS = None
+_YOUTUBE = None
+
+# Secrets keyed by secret ID, with when they were fetched and their parsed value
+_SECRETS_CACHE = {}
+
+# Public URL prefix of each bucket objects are uploaded to
+_S3_URL_PREFIXES = {}
+
+# Loopback HTTP server ffmpeg reads S3 objects through, started on first use
+_S3_PROXY = None
+
+# Pooled HTTP session so warm invocations reuse the webhook connection
+_HTTP = None
+
+# Background work that shouldn't block the upload path
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+# Kept separate so S3 read-ahead never waits behind other background work
+_PREFETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file object backed by an S3 object
+
+    A background producer streams a ranged GetObject from the current
+    position into a bounded queue, so the next chunks download from S3 while
+    earlier ones are still being consumed. Seeking elsewhere (e.g. when a
+    resumable upload rewinds to retry a chunk) stops the producer and the
+    next read restarts it at the new offset.
+
+    An already open GetObject body can be passed in to serve the first read
+    from offset 0 without another request.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, size, chunk_size=UPLOAD_CHUNK_SIZE, prefetch_chunks=PREFETCH_CHUNKS, body=None):
+        super().__init__()
+        self._s3 = s3_client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._size = size
+        self._initial_body = body
+        self._chunk_size = chunk_size
+        self._prefetch_chunks = prefetch_chunks
+        self._pos = 0
+        self._queue = None
+        self._stop = None
+        self._chunk = memoryview(b'')
+        self._stream_pos = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        if self._pos >= self._size:
+            return 0
+
+        # (Re)start the producer if this is the first read or we seeked away
+        if self._queue is None or self._stream_pos != self._pos:
+            self._stop_producer()
+            self._start_producer()
+
+        if not self._chunk:
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._stop_producer()
+                if isinstance(item, IOError):
+                    raise item
+                # botocore's streaming and connection errors aren't IOErrors; wrap
+                # them so the resumable upload treats them as retriable
+                raise IOError(f"Error reading s3://{self._bucket_name}/{self._key} at byte {self._pos}: {item}") from item
+            if item is None:
+                self._stop_producer()
+                raise IOError(f"Unexpected end of stream for s3://{self._bucket_name}/{self._key} at byte {self._pos}")
+            self._chunk = memoryview(item)
+
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        self._pos += n
+        self._stream_pos = self._pos
+        return n
+
+    def close(self):
+        self._stop_producer()
+        if self._initial_body is not None:
+            self._initial_body.close()
+            self._initial_body = None
+        super().close()
+
+    def _start_producer(self):
+        # The initial body is only usable if we're starting from the beginning
+        body = self._initial_body
+        self._initial_body = None
+        if body is not None and self._pos != 0:
+            body.close()
+            body = None
+
+        self._queue = queue.Queue(maxsize=self._prefetch_chunks)
+        self._stop = threading.Event()
+        self._stream_pos = self._pos
+        _PREFETCH_EXECUTOR.submit(self._produce, self._pos, self._queue, self._stop, body)
+
+    def _stop_producer(self):
+        if self._stop is not None:
+            self._stop.set()
+        self._queue = None
+        self._stop = None
+        self._chunk = memoryview(b'')
+        self._stream_pos = None
+
+    def _produce(self, start, chunks, stop, body=None):
+        pos = start
+        reopened = body is None
+        try:
+            while True:
+                if body is None:
+                    body = self._s3.get_object(
+                        Bucket=self._bucket_name,
+                        Key=self._key,
+                        Range=f"bytes={pos}-"
+                    )['Body']
+                try:
+                    for chunk in body.iter_chunks(self._chunk_size):
+                        if not self._put(chunks, stop, chunk):
+                            return
+                        pos += len(chunk)
+                    break
+                except Exception:
+                    # A body handed in by the caller may have gone stale while it
+                    # sat unread, so retry once with a fresh ranged GET
+                    if reopened:
+                        raise
+                    body.close()
+                    body = None
+                    reopened = True
+            self._put(chunks, stop, None)
+        except Exception as e:
+            self._put(chunks, stop, e)
+        finally:
+            if body is not None:
+                body.close()
+
+    @staticmethod
+    def _put(chunks, stop, item):
+        # Block while the queue is full, but give up once the consumer stops us
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class S3RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves S3 objects over plain HTTP on the loopback interface
+
+    ffmpeg and ffprobe read the source video through this rather than a
+    presigned HTTPS URL. The static ffmpeg build can't resolve hostnames
+    without nscd, which the Lambda image doesn't run, while a loopback IP
+    needs neither DNS nor TLS. Range headers are passed through to
+    GetObject, so only the parts ffmpeg asks for are fetched from S3.
+
+    Paths are /<bucket>/<key>, URL-quoted.
+    """
+
+    def do_GET(self):
+        bucket_name, _, key = urllib.parse.unquote(self.path.lstrip('/')).partition('/')
+        params = {'Bucket': bucket_name, 'Key': key}
+        if self.headers.get('Range'):
+            params['Range'] = self.headers['Range']
+
+        try:
+            response = _S3.get_object(**params)
+        except ClientError as e:
+            self.send_error(e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 502)
+            return
+        except Exception as e:
+            logger.warning("Error opening s3://%s/%s for ffmpeg: %s", bucket_name, key, e)
+            self.send_error(502)
+            return
+
+        body = response['Body']
+        try:
+            self.send_response(206 if response.get('ContentRange') else 200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(response['ContentLength']))
+            if response.get('ContentRange'):
+                self.send_header('Content-Range', response['ContentRange'])
+            self.end_headers()
+
+            for chunk in body.iter_chunks(PROXY_CHUNK_SIZE):
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg drops the connection when it seeks elsewhere
+            pass
+        except Exception as e:
+            # Closing the connection early lets ffmpeg see the short read
+            logger.warning("Error streaming s3://%s/%s to ffmpeg: %s", bucket_name, key, e)
+        finally:
+            body.close()
+
+    def log_message(self, format, *args):
+        logger.debug("S3 proxy: " + format, *args)
+
+
+def get_s3_proxy_url(bucket_name, key):
+    """
+    Get a loopback HTTP URL ffmpeg and ffprobe can read an S3 object through
+
+    The proxy server is started on first use and kept for warm invocations.
+    """
+    global _S3_PROXY
+
+    if _S3_PROXY is None:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), S3RangeRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _S3_PROXY = server
+
+    host, port = _S3_PROXY.server_address[:2]
+    return f"http://{host}:{port}/{urllib.parse.quote(bucket_name)}/{urllib.parse.quote(key)}"
+
+
+def _token_is_fresh(creds):
+    """
+    Check whether the access token is valid for at least TOKEN_REFRESH_MARGIN_SECONDS more
+    """
+    if not creds.token or not creds.expiry:
+        return False
+    
+    # google-auth keeps expiry as a naive UTC datetime
+    remaining = (creds.expiry - datetime.datetime.utcnow()).total_seconds()
+    return remaining > TOKEN_REFRESH_MARGIN_SECONDS
+
+
+def _configured_secret_ids():
+    """
+    Get the IDs of all secrets the function is configured to use
+    """
+    secret_ids = [os.environ.get('YOUTUBE_API_SECRET_ID'), os.environ.get('WEBHOOK_SECRET_ID')]
+    return [secret_id for secret_id in secret_ids if secret_id]
+
+
+def _load_secrets(secret_ids):
+    """
+    Fetch several secrets from AWS Secrets Manager in one request and cache them
+    """
+    response = _SECRETS.batch_get_secret_value(SecretIdList=list(secret_ids))
+    fetched_at = time.monotonic()
+    
+    for secret in response['SecretValues']:
+        entry = {"fetched_at": fetched_at, "secret_string": secret['SecretString'], "value": None}
+        # Index by both name and ARN so either form of secret ID can be looked up
+        _SECRETS_CACHE[secret['Name']] = entry
+        _SECRETS_CACHE[secret['ARN']] = entry
+    
+    for error in response.get('Errors', []):
+        logger.error("Error retrieving secret %s: %s %s", error.get('SecretId'), error.get('ErrorCode'), error.get('Message'))
+
+
+def _get_cached_secret(secret_id, parse=None):
+    """
+    Get a secret value from AWS Secrets Manager, cached for SECRET_CACHE_TTL_SECONDS
+    
+    On a cache miss all configured secrets are fetched together, so the
+    YouTube and webhook secrets only cost a single request.
+    
+    Parameters:
+        secret_id (str): ID of the secret
+        parse (callable, optional): Applied to the SecretString once per fetch; its result is cached
+    """
+    entry = _SECRETS_CACHE.get(secret_id)
+    if entry is None or time.monotonic() - entry["fetched_at"] >= SECRET_CACHE_TTL_SECONDS:
+        _load_secrets(set(_configured_secret_ids()) | {secret_id})
+        entry = _SECRETS_CACHE.get(secret_id)
+        if entry is None:
+            raise Exception(f"Secret {secret_id} could not be retrieved")
+    
+    if entry["value"] is None:
+        entry["value"] = parse(entry["secret_string"]) if parse is not None else entry["secret_string"]
+    return entry["value"]
+
+
+def _persist_secret(secret_id, secret):
+    """
+    Write the updated YouTube secret back to Secrets Manager so cold starts pick up a rotated refresh token
+    """
+    try:
+        _SECRETS.put_secret_value(SecretId=secret_id, SecretString=json.dumps(secret))
+        _SECRETS_CACHE[secret_id] = {"fetched_at": time.monotonic(), "secret_string": json.dumps(secret), "value": secret}
+        logger.info("Persisted rotated YouTube refresh token")
+    except Exception as e:
+        logger.error("Error persisting rotated YouTube refresh token: %s", e)
+
+
+def _load_credentials(secret_id):
+    """
+    Build YouTube credentials from the (cached) secret in AWS Secrets Manager
+    """
+    from google.oauth2.credentials import Credentials
+    
+    # Get secret from AWS Secrets Manager
+    secret = _get_cached_secret(secret_id, json.loads)
+    
+    # Extract credentials from secret
+    token = secret.get("TOKEN")
+    refresh_token = secret.get("REFRESH_TOKEN")
+    token_uri = secret.get("TOKEN_URI")
+    client_id = secret.get("CLIENT_ID")
+    client_secret = secret.get("CLIENT_SECRET")
+    expiry = secret.get("EXPIRY")
+    
+    if not all([token, refresh_token, token_uri, client_id, client_secret]):
+        raise Exception("Missing credential fields in secret")
+    
+    # Create credentials object
+    return Credentials(
+        token=token,
+        refresh_token=refresh_token,
+        token_uri=token_uri,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=[YOUTUBE_UPLOAD_SCOPE],
+        expiry=datetime.datetime.fromisoformat(expiry) if expiry else None
+    )
+
+
+def _refresh_credentials(creds, secret_id):
+    """
+    Refresh the YouTube access token in place
+    """
+    from google.auth.transport.requests import Request
+    
+    logger.info("Refreshing YouTube access token")
+    previous_refresh_token = creds.refresh_token
+    creds.refresh(Request())
+    
+    # The access token only needs to live in memory; the secret is only
+    # rewritten in the rare case Google rotated the refresh token, and
+    # synchronously since losing that write would break cold starts
+    if creds.refresh_token != previous_refresh_token:
+        secret = dict(
+            _get_cached_secret(secret_id, json.loads),
+            TOKEN=creds.token,
+            REFRESH_TOKEN=creds.refresh_token,
+            EXPIRY=creds.expiry.isoformat()
+        )
+        _persist_secret(secret_id, secret)
 
 
 def get_authenticated_service():
     """
     Get authenticated YouTube service using credentials from AWS Secrets Manager
+    
+    The credentials and service are cached for warm invocations and the
+    access token is refreshed in place when it is close to expiring. If the
+    refresh is rejected, the secret is re-fetched so credentials updated in
+    Secrets Manager are picked up without a cold start.
     """
+    global _CREDS, _YOUTUBE
+    
     try:
-        # Get AWS region from environment variable with fallback to us-west-1
-        aws_region = os.environ.get('AWS_SECRETS_MANAGER_REGION', 'us-west-1')
+        if _CREDS is not None and _token_is_fresh(_CREDS):
+            return _YOUTUBE
         
-        # Initialize AWS Secrets Manager client
-        secrets_client = boto3.client('secretsmanager', region_name=aws_region)
+        # The Google client libraries are slow to import, so only pay for them when needed
+        from google.auth.exceptions import RefreshError
+        from googleapiclient.discovery import build
         
         # Get secret ID from environment variable
         secret_id = os.environ.get('YOUTUBE_API_SECRET_ID')
         if not secret_id:
             raise Exception("YOUTUBE_API_SECRET_ID environment variable not set")
         
-        # Get secret from AWS Secrets Manager
-        response = secrets_client.get_secret_value(SecretId=secret_id)
-        secret = json.loads(response['SecretString'])
-        
-        # Extract credentials from secret
-        token = secret.get("TOKEN")
-        refresh_token = secret.get("REFRESH_TOKEN")
-        token_uri = secret.get("TOKEN_URI")
-        client_id = secret.get("CLIENT_ID")
-        client_secret = secret.get("CLIENT_SECRET")
-        
-        if not all([token, refresh_token, token_uri, client_id, client_secret]):
-            raise Exception("Missing credential fields in secret")
-        
-        # Create credentials object
-        creds = Credentials(
-            token=token,
-            refresh_token=refresh_token,
-            token_uri=token_uri,
-            client_id=client_id,
-            client_secret=client_secret,
-            scopes=[YOUTUBE_UPLOAD_SCOPE]
-        )
+        creds = _CREDS
+        if creds is None:
+            creds = _load_credentials(secret_id)
+        
+        if not _token_is_fresh(creds):
+            try:
+                _refresh_credentials(creds, secret_id)
+            except RefreshError as e:
+                # The refresh token may have been revoked and replaced in the
+                # secret (e.g. after re-authorising), so drop everything cached
+                # and retry once with a freshly fetched secret
+                logger.warning("YouTube token refresh failed, reloading credentials from the secret: %s", e)
+                _CREDS = None
+                _YOUTUBE = None
+                _SECRETS_CACHE.pop(secret_id, None)
+                creds = _load_credentials(secret_id)
+                if not _token_is_fresh(creds):
+                    _refresh_credentials(creds, secret_id)
         
         if not creds or not creds.valid:
             raise Exception("Invalid credentials")
-            
-        return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, credentials=creds)
+        
+        # Refreshing updates the credentials the service's HTTP client already
+        # holds, so the service only has to be built once per sandbox
+        if _YOUTUBE is None:
+            _YOUTUBE = build(
+                YOUTUBE_API_SERVICE_NAME,
+                YOUTUBE_API_VERSION,
+                credentials=creds,
+                static_discovery=True,
+                cache_discovery=False
+            )
+        
+        # Only cache the credentials once the service exists, so a failed build
+        # can't leave fresh credentials behind without a service to return
+        _CREDS = creds
+        return _YOUTUBE
         
     except Exception as e:
-        print(f"Error in authentication: {e}")
+        logger.error("Error in authentication: %s", e)
         raise
 
 
 def get_webhook_secret():
     """
     Get webhook authentication details from AWS Secrets Manager
+    
+    The secret is cached for SECRET_CACHE_TTL_SECONDS across warm invocations.
+    
+    Returns:
+        bytes: The webhook signing key, or None if unavailable
     """
     try:
-        # Get AWS region from environment variable with fallback to us-west-1
-        aws_region = os.environ.get('AWS_SECRETS_MANAGER_REGION', 'us-west-1')
-        
-        # Initialize AWS Secrets Manager client
-        secrets_client = boto3.client('secretsmanager', region_name=aws_region)
-        
         # Get secret ID from environment variable
         secret_id = os.environ.get('WEBHOOK_SECRET_ID')
         if not secret_id:
-            print("WEBHOOK_SECRET_ID environment variable not set, webhook authentication will not be used")
+            logger.warning("WEBHOOK_SECRET_ID environment variable not set, webhook authentication will not be used")
             return None
         
         # Get secret from AWS Secrets Manager
-        response = secrets_client.get_secret_value(SecretId=secret_id)
-        # Return the secret as plain text, not JSON
-        return response['SecretString']
+        # The secret is plain text, not JSON; encode it once per fetch for signing
+        return _get_cached_secret(secret_id, lambda value: value.encode('utf-8'))
         
     except Exception as e:
-        print(f"Error retrieving webhook secret: {e}")
+        logger.error("Error retrieving webhook secret: %s", e)
         return None
 
 
-def get_video_duration(video_path):
+def get_http_session():
+    """
+    Get the pooled HTTP session used for webhook notifications
+    """
+    global _HTTP
+    
+    if _HTTP is None:
+        import requests
+        
+        _HTTP = requests.Session()
+        _HTTP.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    
+    return _HTTP
+
+
+def sign_webhook_payload(payload):
+    """
+    Compute the HMAC SHA256 signature of a webhook payload
+    
+    Uses the one-shot hmac.digest(), which hands the whole computation to
+    OpenSSL instead of building a Python-level HMAC object.
+    
+    Returns:
+        str: Hex digest of the signature, or None if no webhook secret is available
+    """
+    webhook_secret = get_webhook_secret()
+    if not webhook_secret:
+        return None
+    
+    return hmac.digest(webhook_secret, payload, 'sha256').hex()
+
+
+def read_s3_range(bucket_name, key, offset, length):
+    """
+    Read a byte range of an S3 object
+    
+    Returns:
+        bytes: Up to length bytes starting at offset
+    """
+    response = _S3.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+    try:
+        return response['Body'].read()
+    finally:
+        response['Body'].close()
+
+
+def read_mp4_duration(read, size):
+    """
+    Get the duration of an MP4/MOV file in milliseconds from its mvhd box
+    
+    Only the box headers on the way to moov/mvhd are read, so this costs a
+    handful of small reads wherever the moov atom sits in the file.
+    
+    Parameters:
+        read (callable): Called as read(offset, length) to get bytes of the file
+        size (int): Size of the file in bytes
+    
+    Returns:
+        int: Duration of the video in milliseconds, or None if the file isn't
+        MP4/MOV or the duration isn't recorded in the mvhd box
+    """
+    def find_box(box_type, start, end):
+        offset = start
+        for _ in range(MP4_MAX_BOXES):
+            if offset + 8 > end:
+                return None
+            
+            header = read(offset, 16)
+            if len(header) < 8:
+                return None
+            box_size, found_type = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if box_size == 1:
+                if len(header) < 16:
+                    return None
+                box_size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif box_size == 0:
+                # The last box may extend to the end of the file
+                box_size = end - offset
+            
+            # Anything else means this isn't an ISO base media file
+            if not found_type.isalpha() or box_size < header_size or offset + box_size > end:
+                return None
+            
+            if found_type == box_type:
+                return offset + header_size, offset + box_size
+            offset += box_size
+        return None
+    
+    moov = find_box(b'moov', 0, size)
+    if moov is None:
+        return None
+    mvhd = find_box(b'mvhd', *moov)
+    if mvhd is None:
+        return None
+    
+    body = read(mvhd[0], 32)
+    if body[:1] == b'\x01':
+        if len(body) < 32:
+            return None
+        timescale, duration = struct.unpack('>IQ', body[20:32])
+        unknown = 0xFFFFFFFFFFFFFFFF
+    else:
+        if len(body) < 20:
+            return None
+        timescale, duration = struct.unpack('>II', body[12:20])
+        unknown = 0xFFFFFFFF
+    
+    # Fragmented files leave the duration at 0 or all ones
+    if not timescale or not duration or duration == unknown:
+        return None
+    return duration * 1000 // timescale
+
+
+def probe_video(video_path):
+    """
+    Run ffprobe on a video file
+    
+    Parameters:
+        video_path (str): Path or URL of the video file
+    
+    Returns:
+        dict: The parsed ffprobe output, with 'streams' and 'format' sections
+    """
+    process = subprocess.run(
+        [
+            'ffprobe', '-v', 'error', '-rw_timeout', str(FFMPEG_RW_TIMEOUT_SECONDS * 1000000),
+            '-show_format', '-show_streams', '-of', 'json', video_path
+        ],
+        capture_output=True,
+        check=True,
+        timeout=FFMPEG_TIMEOUT_SECONDS
+    )
+    return json.loads(process.stdout)
+
+
+def get_video_duration(video_path, read=None, size=None):
     """
     Get the duration of a video file in milliseconds
     
+    When read and size are given the duration is first read straight from
+    the MP4 headers, and ffprobe only runs for files that can't be parsed.
+    
+    Parameters:
+        video_path (str): Path or URL of the video file
+        read (callable, optional): Called as read(offset, length) to get bytes of the file
+        size (int, optional): Size of the file in bytes
+    
     Returns:
-        int: Duration of the video in milliseconds
+        tuple: Duration of the video in milliseconds, and the ffprobe result so
+        it can be reused; either is None if it couldn't be determined
     """
+    if read is not None and size is not None:
+        try:
+            duration_ms = read_mp4_duration(read, size)
+            if duration_ms is not None:
+                logger.info("Video duration: %s ms", duration_ms)
+                return duration_ms, None
+        except Exception as e:
+            logger.warning("Error reading MP4 duration, falling back to ffprobe: %s", e)
+    
+    probe = None
     try:
-        probe = ffmpeg.probe(video_path)
+        probe = probe_video(video_path)
         video_info = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
         
         if video_info is None:
-            print("No video stream found")
-            return None
+            logger.warning("No video stream found")
+            return None, probe
         
         # Get duration in seconds (as a float)
         if 'duration' in video_info:
@@ -116,26 +728,27 @@ def get_video_duration(video_path):
         elif 'duration' in probe['format']:
             duration_sec = float(probe['format']['duration'])
         else:
-            print("Duration not found in video or format information")
-            return None
+            logger.warning("Duration not found in video or format information")
+            return None, probe
         
         # Convert to milliseconds
         duration_ms = int(duration_sec * 1000)
-        print(f"Video duration: {duration_ms} ms")
-        return duration_ms
+        logger.info("Video duration: %s ms", duration_ms)
+        return duration_ms, probe
     except Exception as e:
-        print(f"Error getting video duration: {e}")
-        return None
+        logger.error("Error getting video duration: %s", e)
+        return None, probe
 
 
-def generate_thumbnail(video_path, duration_ms=None):
+def generate_thumbnail(video_path, duration_ms=None, probe=None):
     """
     Generate a thumbnail from the middle of a video file
     with the same dimensions as the original video
     
     Parameters:
-        video_path (str): Path to the video file
+        video_path (str): Path or URL of the video file
         duration_ms (int, optional): Duration of the video in milliseconds. If None, it will be calculated.
+        probe (dict, optional): ffprobe result for the video. If None, the video will be probed when the duration is unknown.
     
     Returns:
         str: Path to the generated thumbnail file, or None if generation failed
@@ -146,28 +759,22 @@ def generate_thumbnail(video_path, duration_ms=None):
         thumbnail_path = f'/tmp/{thumbnail_filename}'
         
         # Print details of the file we're trying to process
-        print(f"Attempting to generate thumbnail from: {video_path}")
-        print(f"Target thumbnail path: {thumbnail_path}")
-        
-        # Check if video file exists and is accessible
-        if not os.path.exists(video_path):
-            print(f"Error: Video file does not exist: {video_path}")
-            return None
-            
-        if not os.access(video_path, os.R_OK):
-            print(f"Error: Video file is not readable: {video_path}")
-            return None
+        logger.info("Attempting to generate thumbnail from: %s", video_path)
+        logger.debug("Target thumbnail path: %s", thumbnail_path)
         
-        # Get video information to determine dimensions and duration if not provided
+        # Get video information to determine the duration if not provided;
+        # with a known duration, a missing video stream makes ffmpeg fail below
         try:
-            probe = ffmpeg.probe(video_path)
-            video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-            
-            if video_stream is None:
-                print("No video stream found")
-                return None
-            
-            print(f"Original video dimensions: {video_stream.get('width')}x{video_stream.get('height')}")
+            if probe is None and duration_ms is None:
+                probe = probe_video(video_path)
+            if probe is not None:
+                video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+                
+                if video_stream is None:
+                    logger.warning("No video stream found")
+                    return None
+                
+                logger.debug("Original video dimensions: %sx%s", video_stream.get('width'), video_stream.get('height'))
             
             # Calculate duration if not provided
             if duration_ms is None:
@@ -176,119 +783,166 @@ def generate_thumbnail(video_path, duration_ms=None):
                 elif 'duration' in probe['format']:
                     duration_sec = float(probe['format']['duration'])
                 else:
-                    print("Duration not found in video or format information")
+                    logger.warning("Duration not found in video or format information")
                     return None
                 
                 duration_ms = int(duration_sec * 1000)
-                print(f"Calculated video duration: {duration_ms} ms")
+                logger.info("Calculated video duration: %s ms", duration_ms)
         except Exception as e:
-            print(f"Error probing video file: {e}")
+            logger.error("Error probing video file: %s", e)
             return None
         
         # Calculate the middle point of the video in seconds
         middle_point_sec = duration_ms / 2000  # Convert ms to seconds and find middle
-        print(f"Using middle point for thumbnail: {middle_point_sec} seconds")
-        
-        # Verify the /tmp directory is writable
-        print(f"Checking if /tmp directory is writable: {os.access('/tmp', os.W_OK)}")
+        logger.debug("Using middle point for thumbnail: %s seconds", middle_point_sec)
         
-        # Try using ffmpeg-python library first
-        ffmpeg_success = False
+        # Generate the thumbnail by running ffmpeg directly
         try:
-            print("Attempting to generate thumbnail using ffmpeg-python...")
-            print(f"Creating thumbnail at path: {thumbnail_path} using middle point {middle_point_sec}")
+            logger.debug("Attempting to generate thumbnail using ffmpeg...")
+            logger.debug("Creating thumbnail at path: %s using middle point %s", thumbnail_path, middle_point_sec)
             
-            # Ensure thumbnail directory exists
-            # os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            # Seek on the input to the nearest keyframe instead of decoding up to
+            # the exact timestamp, and skip the audio, subtitle and data streams
+            # since only one frame is needed
+            command = [
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-rw_timeout', str(FFMPEG_RW_TIMEOUT_SECONDS * 1000000),
+                '-noaccurate_seek', '-ss', str(middle_point_sec), '-i', video_path,
+                '-an', '-sn', '-dn', '-frames:v', '1', '-qscale:v', str(THUMBNAIL_JPEG_QUALITY),
+                '-y', thumbnail_path
+            ]
+            logger.debug("Running ffmpeg command: %s", command)
             
             # Run the ffmpeg command with full paths
-            process = (
-                ffmpeg
-                .input(video_path, ss=middle_point_sec)
-                .output(thumbnail_path, vframes=1)
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
-            )
-            # Always print ffmpeg output
-            print(f"ffmpeg stdout: {process[0].decode('utf-8')}")
-            print(f"ffmpeg stderr: {process[1].decode('utf-8')}")
-            print("ffmpeg command executed successfully using ffmpeg-python")
-            
-            # Print the actual ffmpeg command that was run
-            print(f"ffmpeg command that was executed: {' '.join(ffmpeg.input(video_path, ss=middle_point_sec).output(thumbnail_path, vframes=1).compile())}")
-            
-            ffmpeg_success = True
-        except ffmpeg.Error as e:
-            print(f"ffmpeg stderr: {e.stderr.decode('utf-8') if hasattr(e, 'stderr') else 'No stderr'}")
-            print(f"ffmpeg stdout: {e.stdout.decode('utf-8') if hasattr(e, 'stdout') else 'No stdout'}")
-            
+            process = subprocess.run(command, capture_output=True, check=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+            logger.debug("ffmpeg stdout: %s", process.stdout.decode('utf-8'))
+            logger.debug("ffmpeg stderr: %s", process.stderr.decode('utf-8'))
+            logger.debug("ffmpeg command executed successfully")
+        except subprocess.CalledProcessError as e:
+            logger.error("ffmpeg stderr: %s", e.stderr.decode('utf-8') if e.stderr else 'No stderr')
+            logger.error("ffmpeg stdout: %s", e.stdout.decode('utf-8') if e.stdout else 'No stdout')
+        except subprocess.TimeoutExpired:
+            logger.error("ffmpeg did not finish within %ds", FFMPEG_TIMEOUT_SECONDS)
         
-        # List the files in /tmp to debug
-        print(f"Files in /tmp: {os.listdir('/tmp')}")
-        
-        # Check if the thumbnail file was created in a subdirectory
-        if not os.path.exists(thumbnail_path):
-            print(f"Thumbnail not found at {thumbnail_path}, checking subdirectories...")
-            # Try to find the thumbnail in subdirectories
-            for root, dirs, files in os.walk('/tmp'):
-                for file in files:
-                    if thumbnail_filename in file:
-                        print(f"Found thumbnail at: {os.path.join(root, file)}")
-                        thumbnail_path = os.path.join(root, file)
-                        break
-        
-        # Verify the thumbnail was actually created
-        if os.path.exists(thumbnail_path):
-            size = os.path.getsize(thumbnail_path)
-            print(f"Thumbnail file exists with size: {size} bytes")
-            if size > 0:
-                print(f"Thumbnail generated at {thumbnail_path}")
-                return thumbnail_path
-            else:
-                print(f"Thumbnail file is empty (0 bytes)")
-                return None
+        # Verify the thumbnail was actually created, with a single stat call
+        try:
+            size = os.stat(thumbnail_path).st_size
+        except FileNotFoundError:
+            logger.warning("Thumbnail generation failed: file not found at %s", thumbnail_path)
+            return None
+        
+        logger.debug("Thumbnail file exists with size: %d bytes", size)
+        if size > 0:
+            logger.info("Thumbnail generated at %s", thumbnail_path)
+            return thumbnail_path
         else:
-            print(f"Thumbnail generation failed: file not found at {thumbnail_path}")
+            logger.warning("Thumbnail file is empty (0 bytes)")
             return None
     except Exception as e:
-        print(f"Error generating thumbnail: {e}")
-        # Show the traceback for better debugging
-        import traceback
-        print(traceback.format_exc())
+        # Include the traceback for better debugging
+        logger.exception("Error generating thumbnail: %s", e)
         return None
 
 
-def upload_to_s3(local_file_path, bucket_name, key):
+def upload_to_s3(local_file_path, bucket_name, key, content_type=None):
     """
     Upload a file to S3 bucket
     
+    Parameters:
+        content_type (str, optional): Content-Type to store with the object
+    
     Returns:
         str: The S3 URL of the uploaded file, or None if upload fails
     """
     try:
-        # Verify the file exists before trying to upload
-        if not os.path.exists(local_file_path):
-            print(f"File does not exist: {local_file_path}")
-            return None
-            
-        s3 = boto3.client('s3')
-        s3.upload_file(local_file_path, bucket_name, key)
+        extra_args = {'ContentType': content_type} if content_type else None
+        _S3.upload_file(local_file_path, bucket_name, key, ExtraArgs=extra_args)
         
         # Generate the S3 URL
-        region = os.environ.get('AWS_SECRETS_MANAGER_REGION', 'us-west-1')
-        s3_url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{key}"
+        prefix = _S3_URL_PREFIXES.get(bucket_name)
+        if prefix is None:
+            region = os.environ.get('AWS_SECRETS_MANAGER_REGION', 'us-west-1')
+            prefix = _S3_URL_PREFIXES[bucket_name] = f"https://{bucket_name}.s3.{region}.amazonaws.com/"
+        s3_url = prefix + key
         
-        print(f"File uploaded to S3: {s3_url}")
+        logger.info("File uploaded to S3: %s", s3_url)
         return s3_url
+    except FileNotFoundError:
+        logger.warning("File does not exist: %s", local_file_path)
+        return None
     except Exception as e:
-        print(f"Error uploading to S3: {e}")
+        logger.error("Error uploading to S3: %s", e)
         return None
 
 
-def upload_to_youtube(youtube, filepath, title, description="Video uploaded by TennisBuddies", privacy_status="unlisted"):
+def create_thumbnail(video_path, bucket_name, key, read=None, size=None):
+    """
+    Probe a video, generate its thumbnail and upload it to S3
+    
+    The local thumbnail file is removed once uploaded, so the handler has
+    nothing left to clean up.
+    
+    Parameters:
+        video_path (str): Path or URL of the video file
+        bucket_name (str): Bucket to upload the thumbnail to
+        key (str): S3 key of the thumbnail
+        read (callable, optional): Called as read(offset, length) to get bytes of the video
+        size (int, optional): Size of the video in bytes
+    
+    Returns:
+        tuple: Duration of the video in milliseconds and the thumbnail's S3
+        URL; either is None if unavailable
+    """
+    # Get video duration in milliseconds; the probe is reused for the thumbnail
+    duration_ms, probe = get_video_duration(video_path, read=read, size=size)
+    
+    # Generate thumbnail from video
+    thumbnail_path = generate_thumbnail(video_path, duration_ms, probe=probe)
+    
+    # generate_thumbnail only returns the path of a non-empty file
+    if not thumbnail_path:
+        logger.warning("Thumbnail file does not exist or was not generated correctly")
+        return duration_ms, None
+    
+    # Upload to the dedicated thumbnail bucket
+    thumbnail_url = upload_to_s3(thumbnail_path, bucket_name, key, content_type='image/jpeg')
+    
+    # Clean up
+    try:
+        os.remove(thumbnail_path)
+        logger.debug("Removed temporary thumbnail file: %s", thumbnail_path)
+    except Exception as e:
+        logger.error("Error removing temporary thumbnail file: %s", e)
+    
+    return duration_ms, thumbnail_url
+
+
+def get_upload_chunk_size(file_size):
     """
-    Upload a video file to YouTube
+    Get the resumable upload chunk size to use for a file of the given size in bytes
     """
+    if file_size > LARGE_FILE_THRESHOLD:
+        return LARGE_FILE_UPLOAD_CHUNK_SIZE
+    return UPLOAD_CHUNK_SIZE
+
+
+def upload_to_youtube(youtube, stream, mimetype, title, description="Video uploaded by TennisBuddies", privacy_status="unlisted", chunksize=UPLOAD_CHUNK_SIZE):
+    """
+    Upload a video to YouTube from a seekable stream
+    
+    Parameters:
+        youtube: Authenticated YouTube service
+        stream (io.IOBase): Seekable binary stream with the video contents
+        mimetype (str): Mime-type of the video
+        chunksize (int): Size in bytes of each resumable upload request
+    
+    Returns:
+        str: The YouTube video ID, or None if upload fails
+    """
+    import httplib2
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseUpload
+    
     try:
         body = {
             'snippet': {
@@ -302,7 +956,7 @@ def upload_to_youtube(youtube, filepath, title, description="Video uploaded by T
             }
         }
             
-        media = MediaFileUpload(filepath, resumable=True)
+        media = MediaIoBaseUpload(stream, mimetype=mimetype, chunksize=chunksize, resumable=True)
         
         request = youtube.videos().insert(
             part=','.join(body.keys()),
@@ -310,27 +964,93 @@ def upload_to_youtube(youtube, filepath, title, description="Video uploaded by T
             media_body=media
         )
 
-        print("Uploading file to YouTube...")
+        logger.info("Uploading file to YouTube...")
         response = None
+        last_logged_step = 0
+        retry = 0
         while response is None:
-            status, response = request.next_chunk()
-            if status:
-                print(f"Uploading... {int(status.progress() * 100)}%")
+            try:
+                status, response = request.next_chunk()
+            except HttpError as e:
+                if e.resp.status not in RETRIABLE_STATUS_CODES:
+                    raise
+                error = f"A retriable HTTP error {e.resp.status} occurred: {e.content}"
+            except (httplib2.HttpLib2Error, IOError) as e:
+                error = f"A retriable error occurred: {e}"
+            else:
+                retry = 0
+                if status:
+                    progress_step = int(status.progress() * 100) // PROGRESS_LOG_STEP
+                    if progress_step > last_logged_step:
+                        logger.info("Uploading... %d%%", progress_step * PROGRESS_LOG_STEP)
+                        last_logged_step = progress_step
+                continue
+            
+            # The resumable upload picks up where the server says it left off
+            retry += 1
+            if retry > MAX_UPLOAD_RETRIES:
+                raise Exception(f"Giving up after {MAX_UPLOAD_RETRIES} retries: {error}")
+            
+            sleep_seconds = min(2 ** retry, MAX_RETRY_SLEEP_SECONDS)
+            logger.warning("%s; retrying in %d seconds", error, sleep_seconds)
+            time.sleep(sleep_seconds)
 
         video_id = response.get('id')
-        print(f"Upload Complete! Video ID: {video_id}")
+        logger.info("Upload Complete! Video ID: %s", video_id)
         return video_id
 
     except HttpError as e:
-        print(f"An HTTP error {e.resp.status} occurred: {e.content}")
+        logger.error("An HTTP error %s occurred: %s", e.resp.status, e.content)
         return None
     except Exception as e:
-        print(f"An error occurred during upload: {e}")
+        logger.error("An error occurred during upload: %s", e)
+        return None
+
+
+def send_webhook(webhook_url, video_id, thumbnail_url, duration_ms):
+    """
+    Notify the webhook that a video has been uploaded
+    
+    Returns:
+        requests.Response: The webhook response, or None if sending fails
+    """
+    try:
+        webhook_payload = {
+            "youtube_video_id": video_id,
+            "thumbnail_url": thumbnail_url,
+            "duration": duration_ms
+        }
+        
+        # Encode the payload once; the same bytes are signed and sent
+        payload_bytes = json.dumps(webhook_payload, separators=(',', ':')).encode('utf-8')
+        
+        # Set up headers
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        
+        # Add signature if webhook secret is available
+        signature = sign_webhook_payload(payload_bytes)
+        if signature:
+            headers['x-webhook-signature'] = signature
+        
+        # Send the webhook request with headers
+        webhook_response = get_http_session().post(
+            webhook_url, 
+            headers=headers,
+            data=payload_bytes,
+            timeout=WEBHOOK_TIMEOUT_SECONDS
+        )
+        
+        logger.info("Webhook notification sent to %s. Response: %s", webhook_url, webhook_response.status_code)
+        return webhook_response
+    except Exception as e:
+        logger.error("Error sending webhook notification: %s", e)
         return None
 
 
 def lambda_handler(event, context):
-    """Lambda function that downloads an S3 object and uploads it to YouTube
+    """Lambda function that streams an S3 object to YouTube
     
     Parameters
     ----------
@@ -348,14 +1068,6 @@ def lambda_handler(event, context):
     # Get the S3 key from the event
     s3_key = event.get('s3_key')
     
-    # Get YouTube metadata from the event or use defaults
-    video_title = event.get('title', f"TennisBuddies - {os.path.basename(s3_key)}")
-    video_description = event.get('description', "Video uploaded by TennisBuddies")
-    privacy_status = event.get('privacy_status', 'unlisted')
-    
-    # Get webhook URL if provided
-    webhook_url = event.get('webhook_url')
-    
     if not s3_key:
         return {
             "statusCode": 400,
@@ -364,45 +1076,61 @@ def lambda_handler(event, context):
             }),
         }
     
-    # Initialize S3 client
-    s3 = boto3.client('s3')
+    # Used for both the default title and the thumbnail key
+    video_name = os.path.basename(s3_key)
+    
+    # Get YouTube metadata from the event or use defaults
+    video_title = event.get('title', f"TennisBuddies - {video_name}")
+    video_description = event.get('description', "Video uploaded by TennisBuddies")
+    privacy_status = event.get('privacy_status', 'unlisted')
+    
+    # Get webhook URL if provided
+    webhook_url = event.get('webhook_url')
+    
     bucket_name = os.environ.get('S3_BUCKET_NAME')
     # Get the thumbnail bucket name from environment variable
     thumbnail_bucket_name = os.environ.get('S3_THUMBNAIL_BUCKET_NAME')
     
+    video_stream = None
+    
     try:
-        # Get object metadata
-        response = s3.head_object(Bucket=bucket_name, Key=s3_key)
+        # Open the object; the same response carries its size and body
+        response = _S3.get_object(Bucket=bucket_name, Key=s3_key)
         file_size = response['ContentLength']
         
-        # Create temp directory if it doesn't exist
-        temp_dir = '/tmp/downloads'
-        os.makedirs(temp_dir, exist_ok=True)
+        # Use the Content-Type stored with the object, falling back to a
+        # generic video type when it was uploaded without a video type
+        mimetype = response.get('ContentType')
+        if not mimetype or not mimetype.startswith('video/'):
+            mimetype = 'video/*'
         
-        # Download the file
-        local_file_path = f'{temp_dir}/{os.path.basename(s3_key)}'
-        s3.download_file(bucket_name, s3_key, local_file_path)
+        # Stream the video from S3 straight into the YouTube upload
+        chunk_size = get_upload_chunk_size(file_size)
+        video_stream = io.BufferedReader(
+            S3ObjectReader(_S3, bucket_name, s3_key, file_size, chunk_size=chunk_size, body=response['Body']),
+            buffer_size=chunk_size
+        )
         
         # Log the information
-        print(f"Downloaded {s3_key} from {bucket_name}")
-        print(f"File Size: {file_size} bytes")
+        logger.info("Streaming %s from %s", s3_key, bucket_name)
+        logger.info("File Size: %d bytes", file_size)
+        logger.info("Content Type: %s", mimetype)
         
-        # Get video duration in milliseconds
-        duration_ms = get_video_duration(local_file_path)
+        # ffmpeg reads the video over HTTP range requests through the loopback
+        # proxy, so only the parts it needs are fetched instead of the whole object
+        video_url = get_s3_proxy_url(bucket_name, s3_key)
         
-        # Generate thumbnail from video
-        thumbnail_path = generate_thumbnail(local_file_path, duration_ms)
-        
-        # Define thumbnail S3 key and upload to S3
-        thumbnail_s3_key = f"{os.path.basename(s3_key)}-thumbnail.jpg"
-        thumbnail_url = None
-        
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            # Upload to the dedicated thumbnail bucket
-            thumbnail_url = upload_to_s3(thumbnail_path, thumbnail_bucket_name, thumbnail_s3_key)
-        else:
-            print(f"Thumbnail file does not exist or was not generated correctly")
-            thumbnail_path = None  # Reset to None if file doesn't exist
+        # Probe the video and make its thumbnail in the background; none of
+        # it is needed until the webhook, so it overlaps with the YouTube upload
+        thumbnail_s3_key = f"{video_name}-thumbnail.jpg"
+        thumbnail_future = _EXECUTOR.submit(
+            create_thumbnail,
+            video_url,
+            thumbnail_bucket_name,
+            thumbnail_s3_key,
+            read=functools.partial(read_s3_range, bucket_name, s3_key),
+            size=file_size
+        )
         
         # Get authenticated YouTube service
         youtube = get_authenticated_service()
@@ -410,12 +1138,22 @@ def lambda_handler(event, context):
         # Upload video to YouTube
         video_id = upload_to_youtube(
             youtube,
-            local_file_path,
+            video_stream,
+            mimetype,
             title=video_title,
             description=video_description,
-            privacy_status=privacy_status
+            privacy_status=privacy_status,
+            chunksize=chunk_size
         )
         
+        # The thumbnail has usually finished long before the upload; if it is
+        # still stuck, carry on without it rather than holding up the webhook
+        try:
+            duration_ms, thumbnail_url = thumbnail_future.result(timeout=THUMBNAIL_WAIT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Thumbnail did not complete within %ds of the upload", THUMBNAIL_WAIT_SECONDS)
+            duration_ms, thumbnail_url = None, None
+        
         if not video_id:
             return {
                 "statusCode": 500,
@@ -427,64 +1165,7 @@ def lambda_handler(event, context):
         # Send webhook notification if webhook_url is provided
         webhook_response = None
         if webhook_url and video_id:
-            try:
-                # Get webhook secrets if available
-                webhook_secret = get_webhook_secret()
-                
-                webhook_payload = {
-                    "youtube_video_id": video_id,
-                    "thumbnail_url": thumbnail_url,
-                    "duration": duration_ms
-                }
-                
-                # Convert payload to JSON string for signature calculation
-                payload_json = json.dumps(webhook_payload)
-                
-                # Set up headers
-                headers = {
-                    'Content-Type': 'application/json'
-                }
-                
-                # Add signature if webhook secret is available
-                if webhook_secret:
-                    # Create HMAC SHA256 signature
-                    import hmac
-                    import hashlib
-                    
-                    signature = hmac.new(
-                        webhook_secret.encode('utf-8'),
-                        payload_json.encode('utf-8'),
-                        hashlib.sha256
-                    ).hexdigest()
-                    
-                    # Add signature to headers
-                    headers['x-webhook-signature'] = signature
-                
-                # Send the webhook request with headers
-                webhook_response = requests.post(
-                    webhook_url, 
-                    headers=headers,
-                    data=payload_json
-                )
-                
-                print(f"Webhook notification sent to {webhook_url}. Response: {webhook_response.status_code}")
-            except Exception as e:
-                print(f"Error sending webhook notification: {str(e)}")
-        
-        # Clean up
-        try:
-            os.remove(local_file_path)
-            print(f"Removed temporary file: {local_file_path}")
-        except Exception as e:
-            print(f"Error removing temporary file: {str(e)}")
-        
-        # Only try to remove the thumbnail file if it exists
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            try:
-                os.remove(thumbnail_path)
-                print(f"Removed temporary thumbnail file: {thumbnail_path}")
-            except Exception as e:
-                print(f"Error removing temporary thumbnail file: {str(e)}")
+            webhook_response = send_webhook(webhook_url, video_id, thumbnail_url, duration_ms)
         
         return {
             "statusCode": 200,
@@ -500,10 +1181,13 @@ def lambda_handler(event, context):
         }
         
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error("Error: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({
                 "error": str(e)
             }),
         }
+    finally:
+        if video_stream is not None:
+            video_stream.close()